@@ -1,10 +1,299 @@
 import cv2
+import functools
+import io
 import json
 import logging
+import math
 import os
-from concurrent.futures import ThreadPoolExecutor
+import queue
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from fractions import Fraction
+
+import numpy as np
 from tqdm import tqdm
 
+try:
+    from turbojpeg import TJSAMP_420, TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+# File extensions (lower case) of the videos picked up from the input folder.
+VIDEO_EXTENSIONS = {'mov', 'mp4'}
+
+# Marker file written to a frames folder once all frames of the video have been extracted. It holds the
+# frame count and image format as JSON.
+DONE_FILE = '.done'
+
+# Codecs that are decoded with NVDEC when hardware acceleration is enabled. AV1 is left out on purpose,
+# NVDEC only supports it from the Ampere generation on.
+HWACCEL_CODECS = {'h264', 'hevc', 'mpeg1video', 'mpeg2video', 'mpeg4', 'vc1', 'vp8', 'vp9'}
+
+# Global options of every ffmpeg process: never read stdin (workers run in parallel) and only print errors.
+FFMPEG_ARGS = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error']
+
+# Number of decoded frames the OpenCV fallback keeps in memory, waiting for or being written.
+FRAME_PREFETCH = 32
+
+
+def _run_ffmpeg(args):
+    """
+    Runs ffmpeg non-interactively with the given arguments.
+
+    Parameters
+    ----------
+    args : list of str
+        The ffmpeg arguments following the global options.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If ffmpeg exits with a non-zero status.
+    """
+    subprocess.run(FFMPEG_ARGS + ['-y'] + args, check=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _decode_thread_args(threads=0):
+    """
+    Returns the decoder options passed to ffmpeg before -i: frame and slice threading with the given number
+    of threads, where 0 lets the decoder use all cores.
+
+    Parameters
+    ----------
+    threads : int, optional
+        The number of decoder threads. Default is 0.
+    """
+    return ['-threads', str(threads), '-thread_type', 'frame+slice']
+
+
+@functools.lru_cache(maxsize=None)
+def _passthrough_args():
+    """
+    Returns the ffmpeg output options that pass every decoded frame through unchanged.
+
+    Muxers without timestamps, such as image2 and rawvideo, otherwise get a constant frame rate, which
+    duplicates or drops frames of variable frame rate videos. -fps_mode replaces -vsync from ffmpeg 5.1 on.
+    """
+    try:
+        help_text = subprocess.run(['ffmpeg', '-hide_banner', '-h', 'long'], capture_output=True, text=True).stdout
+    except OSError:
+        help_text = ''
+    if '-fps_mode' in help_text:
+        return ['-fps_mode', 'passthrough']
+    return ['-vsync', 'passthrough']
+
+
+@functools.lru_cache(maxsize=None)
+def _hwaccel_available(hwaccel):
+    """
+    Returns whether ffmpeg can open a hardware device of the given type, e.g. whether a CUDA GPU is present.
+
+    The result is cached, so the check runs once per process.
+
+    Parameters
+    ----------
+    hwaccel : str
+        The ffmpeg hardware acceleration type.
+    """
+    try:
+        subprocess.run(
+            FFMPEG_ARGS + ['-init_hw_device', hwaccel, '-f', 'lavfi', '-i', 'nullsrc=s=16x16', '-frames:v', '1',
+                           '-f', 'null', '-'],
+            check=True, capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
+# Hardware acceleration types whose decoding has failed in this process. Videos are then decoded on the CPU,
+# also by the other extractors of a worker process, which each handle one video.
+_failed_hwaccels = set()
+
+
+def _open_capture(video_path):
+    """
+    Opens a video with OpenCV's FFmpeg backend, decoding with one thread per CPU core.
+
+    Parameters
+    ----------
+    video_path : str
+        The path to the video file.
+    """
+    if hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        return cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_N_THREADS, os.cpu_count() or 1])
+    return cv2.VideoCapture(video_path)
+
+
+def _run_ffprobe(video_path, entries):
+    """
+    Runs ffprobe on the first video stream and returns its JSON output, or None if ffprobe is unavailable or
+    fails.
+
+    Parameters
+    ----------
+    video_path : str
+        The path to the video file.
+    entries : str
+        The entries to show, as passed to -show_entries.
+    """
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', entries, '-of', 'json',
+             video_path],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def _probe_codec(video_path):
+    """
+    Returns the codec name of the first video stream, or None if ffprobe is unavailable or fails.
+
+    Parameters
+    ----------
+    video_path : str
+        The path to the video file.
+    """
+    probe = _run_ffprobe(video_path, 'stream=codec_name')
+    try:
+        return probe['streams'][0]['codec_name']
+    except (TypeError, KeyError, IndexError):
+        return None
+
+
+def _probe_frame_size(video_path):
+    """
+    Returns the (width, height) of the decoded frames of the first video stream, or None if ffprobe is
+    unavailable or fails.
+
+    ffmpeg rotates frames according to the display matrix, so width and height are swapped for videos that
+    are rotated by 90 degrees, e.g. portrait videos recorded on phones.
+
+    Parameters
+    ----------
+    video_path : str
+        The path to the video file.
+    """
+    probe = _run_ffprobe(video_path, 'stream=width,height:stream_tags=rotate:stream_side_data=rotation')
+    try:
+        stream = probe['streams'][0]
+        width, height = int(stream['width']), int(stream['height'])
+    except (TypeError, ValueError, KeyError, IndexError):
+        return None
+
+    rotation = stream.get('tags', {}).get('rotate', 0)
+    for side_data in stream.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    if int(float(rotation)) % 180:
+        width, height = height, width
+    return width, height
+
+
+def _probe_metadata(video_path):
+    """
+    Returns the frame count, frame rate and duration of the first video stream, or None if ffprobe is
+    unavailable or fails.
+
+    Only the container headers are read. If the container does not store the number of frames, it is
+    estimated from the duration and frame rate, as OpenCV does.
+
+    Parameters
+    ----------
+    video_path : str
+        The path to the video file.
+    """
+    probe = _run_ffprobe(video_path, 'stream=nb_frames,avg_frame_rate,duration:format=duration')
+    try:
+        stream = probe['streams'][0]
+        fps = float(Fraction(stream['avg_frame_rate'])) if stream.get('avg_frame_rate', '0/0') != '0/0' else 0.0
+        duration = float(stream.get('duration', probe.get('format', {}).get('duration', 0)))
+    except (TypeError, ValueError, KeyError, IndexError, ZeroDivisionError):
+        return None
+
+    try:
+        total_frames = int(stream['nb_frames'])
+    except (KeyError, ValueError):
+        total_frames = round(duration * fps)
+    return {'total_frames': total_frames, 'fps': int(fps), 'duration': int(duration * 1000)}
+
+
+def _keyframe_offsets(video_path):
+    """
+    Returns the keyframes of the first video stream, or an empty list if ffprobe is unavailable or fails.
+
+    Only the packet headers are read, nothing is decoded.
+
+    Parameters
+    ----------
+    video_path : str
+        The path to the video file.
+
+    Returns
+    -------
+    list of tuple
+        (time, frame_number) per keyframe in presentation order. The time is relative to the start of the
+        file, as expected by ffmpeg's -ss input option.
+    """
+    probe = _run_ffprobe(video_path, 'packet=pts,flags:stream=time_base:format=start_time')
+    try:
+        time_base = Fraction(probe['streams'][0]['time_base'])
+        start_time = Fraction(probe['format'].get('start_time', '0'))
+    except (TypeError, ValueError, KeyError, IndexError, ZeroDivisionError):
+        return []
+
+    packets = sorted(
+        (int(packet['pts']), 'K' in packet['flags'])
+        for packet in probe.get('packets', [])
+        if 'pts' in packet and 'D' not in packet.get('flags', '')
+    )
+    return [
+        (float(pts * time_base - start_time), frame_number)
+        for frame_number, (pts, keyframe) in enumerate(packets)
+        if keyframe
+    ]
+
+
+def _jpeg_qscale(quality):
+    """
+    Returns the ffmpeg mjpeg -qscale:v that roughly matches a libjpeg quality.
+
+    libjpeg scales its standard quantization tables by 5000 / quality percent below quality 50 and by
+    200 - 2 * quality percent above; the mjpeg encoder scales the same tables by qscale / 16 (qscale 2-31).
+
+    Parameters
+    ----------
+    quality : int
+        The JPEG quality (0-100).
+
+    Returns
+    -------
+    int
+        The qscale, e.g. 5 for quality 85 and 2 for quality 95 and above.
+    """
+    quality = min(max(quality, 1), 100)
+    scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+    return min(max(round(scale * 16 / 100), 2), 31)
+
+
+def _load_turbojpeg():
+    """
+    Returns a TurboJPEG encoder, or None if PyTurboJPEG or the libjpeg-turbo library is not installed.
+    """
+    if TurboJPEG is None:
+        return None
+    try:
+        return TurboJPEG()
+    except (OSError, RuntimeError):
+        return None
+
 
 class VideoFrameExtractor:
     """
@@ -17,19 +306,39 @@ class VideoFrameExtractor:
     output_folder : str
         The path to the folder where the extracted frames and metadata will be saved.
     use_multithreading : bool, optional
-        Whether to use multithreading to extract frames from multiple videos simultaneously. Default is False.
+        Whether to extract frames from multiple videos simultaneously in worker processes. Default is False.
     image_format : str, optional
         The format to use when saving the extracted frames as images. Default is 'jpg'.
+    hwaccel : str or None, optional
+        The ffmpeg hardware decoder to use, or None to decode on the CPU. Default is 'cuda'.
+    num_workers : int or None, optional
+        The number of worker processes used to process videos in parallel if use_multithreading is set.
+        Default is os.cpu_count().
+    segment_workers : int or None, optional
+        The maximum number of ffmpeg processes decoding segments of one video in parallel. Default is os.cpu_count(),
+        shared between the videos processed in parallel.
+    jpeg_quality : int, optional
+        The JPEG quality (0-100) of extracted frames. Default is 85.
+    write_threads : int, optional
+        The number of threads encoding and writing frames in Python. Default is 8.
+    archive_frames : bool, optional
+        Whether to write the frames of each video into one tar archive instead of a folder. Default is False.
 
     Methods
     -------
     process_video(mov_file)
         Extracts frames from a single video file and saves them as images.
+    frames_already_extracted(mov_file)
+        Checks whether the frames of a video file have already been extracted.
+    iter_frames(mov_file)
+        Decodes a video file and yields its frames without writing them to disk.
     extract_frames_and_metadata()
         Extracts frames and metadata from all video files in the input folder.
     """
 
-    def __init__(self, input_folder, output_folder, use_multithreading=False, image_format='jpg'):
+    def __init__(self, input_folder, output_folder, use_multithreading=False, image_format='jpg', hwaccel='cuda',
+                 num_workers=None, segment_workers=None, jpeg_quality=85, write_threads=8,
+                 archive_frames=False):
         """
         Parameters
         ----------
@@ -38,83 +347,697 @@ class VideoFrameExtractor:
         output_folder : str
             The path to the folder where the extracted frames and metadata will be saved.
         use_multithreading : bool, optional
-            Whether to use multithreading to extract frames from multiple videos simultaneously. Default is False.
+            Whether to extract frames from multiple videos simultaneously in worker processes. Default is False,
+            which processes one video at a time (with ffmpeg, each video is still decoded in parallel segments).
         image_format : str, optional
             The format to use when saving the extracted frames as images. Default is 'jpg'.
+        hwaccel : str or None, optional
+            The ffmpeg hardware decoder to use, or None to decode on the CPU. Default is 'cuda'.
+            It is only used if ffmpeg can open such a device on this host. If hardware decoding fails, the
+            video is decoded on the CPU instead, and so are all further videos in this process.
+        num_workers : int or None, optional
+            The number of worker processes used to process videos in parallel if use_multithreading is set.
+            Default is os.cpu_count().
+        segment_workers : int or None, optional
+            The maximum number of ffmpeg processes decoding segments of one video in parallel.
+            Default is os.cpu_count() divided by the number of videos processed in parallel, so that there are
+            at most about os.cpu_count() ffmpeg processes (and hardware decoder sessions) at a time. Set to 1
+            to decode every video with a single ffmpeg process.
+        jpeg_quality : int, optional
+            The JPEG quality (0-100) of extracted frames. Default is 85, which is far smaller and faster to
+            encode than OpenCV's default of 95. Frames encoded in Python, i.e. without ffmpeg or with
+            archive_frames, use libjpeg-turbo if PyTurboJPEG and libturbojpeg are installed. ffmpeg uses the
+            closest mjpeg -qscale:v instead.
+        write_threads : int, optional
+            The number of threads encoding and writing frames in Python. Default is 8.
+        archive_frames : bool, optional
+            Whether to write the frames of each video into one uncompressed tar archive <video>_frames.tar
+            instead of a folder with one file per frame. Default is False. Archives avoid creating hundreds of
+            thousands of small files, and sharded data loaders read them directly.
         """
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.use_multithreading = use_multithreading
         self.image_format = image_format
+        self.hwaccel = hwaccel
+        self.num_workers = num_workers
+        self.segment_workers = segment_workers
+        self.jpeg_quality = jpeg_quality
+        self.write_threads = write_threads
+        self.archive_frames = archive_frames
+        self._turbojpeg = _load_turbojpeg() if image_format.lower() in ('jpg', 'jpeg') else None
         logging.basicConfig(filename='video_frame_extraction.log', level=logging.INFO)
 
 
     def extract_frames_and_metadata(self):
         """
         Extracts frames and metadata from all video files in the input folder.
+
+        A video that fails is logged and skipped, the remaining videos are still processed. Videos are
+        processed one after another in this process, or in worker processes if use_multithreading is set.
         """
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
             logging.info(f"Created output folder {self.output_folder}")
 
-        mov_files = [f for f in os.listdir(self.input_folder) if f.endswith('.MOV')]
-        logging.info(f"Found {len(mov_files)} .MOV files.")
+        with os.scandir(self.input_folder) as entries:
+            mov_files = [
+                entry.name for entry in entries
+                if entry.name.rpartition('.')[2].lower() in VIDEO_EXTENSIONS and entry.is_file()
+            ]
+        logging.info(f"Found {len(mov_files)} video files.")
+
+        if not self.use_multithreading:
+            for mov_file in tqdm(mov_files):
+                try:
+                    self.process_video(mov_file)
+                except Exception:
+                    logging.exception(f"Failed to extract frames from {mov_file}")
+            return
 
-        with ThreadPoolExecutor() as executor:
-            futures = []
+        options = self._worker_options()
+        num_workers = self.num_workers or os.cpu_count() or 1
+        if self.segment_workers is None:
+            # Split the cores between the videos and their segments instead of starting
+            # os.cpu_count() segments in each of os.cpu_count() worker processes.
+            parallel_videos = max(1, min(len(mov_files), num_workers))
+            options['segment_workers'] = max(1, (os.cpu_count() or 1) // parallel_videos)
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {}
             for mov_file in mov_files:
-                futures.append(executor.submit(self.process_video, mov_file))
+                futures[executor.submit(_process_one, (options, mov_file))] = mov_file
 
             with tqdm(total=len(futures)) as pbar:
-                for future in futures:
-                    future.result()
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception:
+                        logging.exception(f"Failed to extract frames from {futures[future]}")
                     pbar.update(1)
 
+    def _worker_options(self):
+        """
+        Returns the constructor arguments needed to recreate this extractor in a worker process.
+        """
+        return {
+            'input_folder': self.input_folder,
+            'output_folder': self.output_folder,
+            'use_multithreading': self.use_multithreading,
+            'image_format': self.image_format,
+            'hwaccel': self.hwaccel,
+            'segment_workers': self.segment_workers,
+            'jpeg_quality': self.jpeg_quality,
+            'write_threads': self.write_threads,
+            'archive_frames': self.archive_frames,
+        }
+
     def process_video(self, mov_file):
         """
         Extracts frames from a single video file and saves them as images.
 
+        Frames are written by ffmpeg's image2 muxer if ffmpeg is available, otherwise they are decoded and
+        written one by one in Python. If archive_frames is set, the frames are encoded in Python and written
+        into a single tar archive instead.
+
         Parameters
         ----------
         mov_file : str
             The name of the video file to extract frames from.
+
+        Raises
+        ------
+        ValueError
+            If the video cannot be read or no frames could be extracted from it.
         """
-        video_path = os.path.join(self.input_folder, mov_file)
-        cap = cv2.VideoCapture(video_path)
+        if self.frames_already_extracted(mov_file):
+            logging.info(f"Frames of {mov_file} have already been extracted, skipping")
+            return
 
+        video_path = os.path.join(self.input_folder, mov_file)
         frames_folder = os.path.join(self.output_folder, f"{mov_file}_frames")
-        if not os.path.exists(frames_folder):
+        if not self.archive_frames and not os.path.exists(frames_folder):
             os.makedirs(frames_folder)
 
-        metadata = {
-            'video_file': mov_file,
-            'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-            'fps': int(cap.get(cv2.CAP_PROP_FPS)),
-            'duration': int(cap.get(cv2.CAP_PROP_POS_MSEC))
-        }
+        metadata = self._video_metadata(mov_file)
+
+        if self.archive_frames:
+            self._extract_to_archive(mov_file, f"{frames_folder}.tar", metadata['total_frames'])
+        elif shutil.which('ffmpeg'):
+            self._extract_with_ffmpeg(video_path, frames_folder)
+        else:
+            self._extract_to_folder(mov_file, frames_folder, metadata['total_frames'])
+        if not self.archive_frames and not self._count_frames(frames_folder):
+            raise ValueError(f"No frames could be extracted from {mov_file}")
 
-        frame_number = 0
         metadata_file = os.path.join(self.output_folder, f"{mov_file}_metadata.json")
-        with open(metadata_file, 'w') as f:
+        with open(metadata_file, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=4)
 
-        with tqdm(total=metadata['total_frames']) as pbar:
+        if not self.archive_frames:
+            with open(os.path.join(frames_folder, DONE_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'total_frames': metadata['total_frames'], 'image_format': self.image_format}, f)
+
+        logging.info(f"Extracted frames and metadata from {mov_file}")
+
+    def _video_metadata(self, mov_file):
+        """
+        Returns the metadata of a video file.
+
+        The metadata file of a previous run is reused if it exists and has a frame count and duration.
+        Otherwise the metadata is read from the container headers with ffprobe, or with OpenCV if ffprobe is
+        not available.
+
+        Parameters
+        ----------
+        mov_file : str
+            The name of the video file.
+
+        Returns
+        -------
+        dict
+            The video file name, the total number of frames, the frame rate and the duration in milliseconds.
+
+        Raises
+        ------
+        ValueError
+            If neither ffprobe nor OpenCV can read the frame count of the video.
+        """
+        metadata_file = os.path.join(self.output_folder, f"{mov_file}_metadata.json")
+        if os.path.exists(metadata_file):
+            try:
+                with open(metadata_file, encoding='utf-8') as f:
+                    metadata = json.load(f)
+                if metadata.get('total_frames') and metadata.get('duration'):
+                    return metadata
+            except ValueError:
+                pass
+
+        video_path = os.path.join(self.input_folder, mov_file)
+        metadata = _probe_metadata(video_path)
+        if metadata is None:
+            cap = _open_capture(video_path)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            cap.release()
+            if total_frames <= 0:
+                raise ValueError(f"Could not read the frame count of {video_path}")
+            metadata = {
+                'total_frames': total_frames,
+                'fps': int(fps),
+                'duration': int(total_frames / fps * 1000) if fps else 0,
+            }
+        return {'video_file': mov_file, **metadata}
+
+    def frames_already_extracted(self, mov_file):
+        """
+        Checks whether the frames of a video file have already been extracted.
+
+        A completed extraction leaves a marker file in the frames folder, which only counts if it was written
+        for the configured image format. Otherwise the number of images in the frames folder is compared with
+        the frame count stored in the metadata file. If archive_frames is set, the frames have been extracted
+        if the archive exists.
+
+        Parameters
+        ----------
+        mov_file : str
+            The name of the video file.
+
+        Returns
+        -------
+        bool
+            True if all frames of the video are present.
+        """
+        frames_folder = os.path.join(self.output_folder, f"{mov_file}_frames")
+        if self.archive_frames:
+            return os.path.exists(f"{frames_folder}.tar")
+        done_file = os.path.join(frames_folder, DONE_FILE)
+        if os.path.exists(done_file):
+            try:
+                with open(done_file, encoding='utf-8') as f:
+                    marker = json.load(f)
+                if isinstance(marker, dict) and marker.get('image_format') == self.image_format:
+                    return True
+            except ValueError:
+                pass
+
+        metadata_file = os.path.join(self.output_folder, f"{mov_file}_metadata.json")
+        if not os.path.isdir(frames_folder) or not os.path.exists(metadata_file):
+            return False
+
+        try:
+            with open(metadata_file, encoding='utf-8') as f:
+                expected_frames = json.load(f).get('total_frames', 0)
+        except (ValueError, AttributeError):
+            # The metadata file of an interrupted run may be incomplete.
+            return False
+
+        return expected_frames > 0 and self._count_frames(frames_folder) >= expected_frames
+
+    def _count_frames(self, frames_folder):
+        """
+        Returns the number of images in the configured image format in a frames folder.
+
+        Parameters
+        ----------
+        frames_folder : str
+            The frames folder of a video.
+        """
+        suffix = f".{self.image_format}"
+        with os.scandir(frames_folder) as entries:
+            return sum(1 for entry in entries if entry.name.endswith(suffix))
+
+    def iter_frames(self, mov_file, buffers=None):
+        """
+        Decodes a video file and yields its frames without writing them to disk.
+
+        Use this instead of extract_frames_and_metadata if the frames are consumed directly, e.g. by a model,
+        to avoid encoding them as images only to decode them again. If ffmpeg is available, the frames are
+        read as raw BGR images from a single ffmpeg process, otherwise they are decoded with OpenCV.
+
+        Parameters
+        ----------
+        mov_file : str
+            The name of the video file in the input folder.
+        buffers : queue.Queue, optional
+            A pool of arrays to decode the frames into instead of allocating a new array per frame. Every
+            frame is decoded into an array taken from the pool (None entries are replaced by a new array),
+            and the caller puts it back once it is done with the frame. Default is None.
+
+        Yields
+        ------
+        tuple of (int, numpy.ndarray)
+            The frame number, starting at 0, and the frame in BGR order.
+        """
+        video_path = os.path.join(self.input_folder, mov_file)
+        frame_size = _probe_frame_size(video_path) if shutil.which('ffmpeg') else None
+        if frame_size is None:
+            yield from self._iter_frames_opencv(video_path, buffers)
+        else:
+            yield from self._iter_frames_ffmpeg(video_path, *frame_size, buffers)
+
+    def _iter_frames_opencv(self, video_path, buffers):
+        """
+        Yields the frames of a video decoded with cv2.VideoCapture.
+
+        Parameters
+        ----------
+        video_path : str
+            The path to the video file.
+        buffers : queue.Queue or None
+            The pool of arrays to decode into, see iter_frames.
+
+        Raises
+        ------
+        ValueError
+            If OpenCV cannot open the video.
+        """
+        cap = _open_capture(video_path)
+        if not cap.isOpened():
+            cap.release()
+            raise ValueError(f"Could not open {video_path}")
+        try:
+            frame_number = 0
             while True:
-                ret, frame = cap.read()
+                buffer = buffers.get() if buffers is not None else None
+                ret, frame = cap.read(buffer)
                 if not ret:
+                    if buffers is not None:
+                        buffers.put(buffer)
                     break
+                yield frame_number, frame
+                frame_number += 1
+        finally:
+            cap.release()
+
+    def _iter_frames_ffmpeg(self, video_path, width, height, buffers):
+        """
+        Yields the frames of a video decoded by an ffmpeg process that writes raw BGR images to a pipe.
+
+        Hardware decoding uses the configured hwaccel without -hwaccel_output_format here, so ffmpeg
+        downloads the frames itself and falls back to software decoding on its own, since a stream that has
+        already been partly consumed cannot be restarted.
+
+        Parameters
+        ----------
+        video_path : str
+            The path to the video file.
+        width : int
+            The width of the decoded frames.
+        height : int
+            The height of the decoded frames.
+        buffers : queue.Queue or None
+            The pool of arrays to decode into, see iter_frames.
 
-                frame_file = os.path.join(frames_folder, f"frame_{frame_number}.{self.image_format}")
-                cv2.imwrite(frame_file, frame)
+        Raises
+        ------
+        subprocess.CalledProcessError
+            If ffmpeg exits with a non-zero status.
+        """
+        args = list(FFMPEG_ARGS)
+        if self._use_hwaccel(video_path):
+            args += ['-hwaccel', self.hwaccel]
+        args += _decode_thread_args() + ['-i', video_path, '-f', 'rawvideo', '-pix_fmt', 'bgr24']
+        args += _passthrough_args() + ['pipe:1']
+
+        frame_bytes = width * height * 3
+        process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        try:
+            frame_number = 0
+            while True:
+                frame = buffers.get() if buffers is not None else None
+                if frame is None:
+                    frame = np.empty((height, width, 3), np.uint8)
+                if process.stdout.readinto(frame) < frame_bytes:
+                    if buffers is not None:
+                        buffers.put(frame)
+                    break
+                yield frame_number, frame
                 frame_number += 1
+        except GeneratorExit:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+    def _use_hwaccel(self, video_path):
+        """
+        Returns whether a video is decoded with the hardware decoder.
+
+        That is the case if hwaccel is set, ffmpeg can open such a device on this host, hardware decoding has
+        not failed before in this process, and the codec of the video is supported.
+
+        Parameters
+        ----------
+        video_path : str
+            The path to the video file.
+        """
+        if not self.hwaccel or self.hwaccel in _failed_hwaccels or not _hwaccel_available(self.hwaccel):
+            return False
+        return _probe_codec(video_path) in HWACCEL_CODECS
+
+    def _extract_with_ffmpeg(self, video_path, frames_folder):
+        """
+        Decodes and writes all frames of a video with ffmpeg (image2 muxer).
+
+        The video is split at keyframes into up to segment_workers segments that are extracted by
+        parallel ffmpeg processes. Every segment starts on a keyframe, so it decodes independently of
+        the others, and writes its frames starting at the index of that keyframe.
+
+        Parameters
+        ----------
+        video_path : str
+            The path to the video file.
+        frames_folder : str
+            The folder the frames are written to, named frame_<n> starting at 0.
+        """
+        use_hwaccel = self._use_hwaccel(video_path)
+        segments = self._segments(video_path)
+        # Share the cores between the segments instead of giving each ffmpeg process (and its frame
+        # threading queue) one thread per core.
+        threads = max(1, (os.cpu_count() or 1) // len(segments)) if len(segments) > 1 else 0
+
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [
+                executor.submit(self._extract_segment, video_path, frames_folder, use_hwaccel, *segment,
+                                threads=threads)
+                for segment in segments
+            ]
+            for future in futures:
+                future.result()
+
+    def _segments(self, video_path):
+        """
+        Splits a video at keyframes into segments of roughly equal numbers of keyframes.
+
+        Parameters
+        ----------
+        video_path : str
+            The path to the video file.
+
+        Returns
+        -------
+        list of tuple
+            (start_time, start_number, num_frames) per segment. The first segment has no start_time and
+            the last one no num_frames, so together they always cover the whole video.
+        """
+        segment_workers = self.segment_workers or os.cpu_count() or 1
+        if segment_workers < 2:
+            return [(None, 0, None)]
+
+        keyframes = _keyframe_offsets(video_path)
+        count = min(len(keyframes), segment_workers)
+        if count < 2:
+            return [(None, 0, None)]
+
+        starts = keyframes[::math.ceil(len(keyframes) / count)]
+        # The first segment starts at the beginning of the video, even if its first keyframe does not.
+        starts[0] = (None, 0)
+        segments = []
+        for (start_time, start_number), next_start in zip(starts, starts[1:] + [None]):
+            num_frames = next_start[1] - start_number if next_start else None
+            segments.append((start_time, start_number, num_frames))
+        return segments
+
+    def _extract_segment(self, video_path, frames_folder, use_hwaccel, start_time, start_number, num_frames,
+                         threads=0):
+        """
+        Extracts one segment of a video with a single ffmpeg process.
+
+        The segment is decoded on the GPU if use_hwaccel is set; if that fails, it is decoded again on
+        the CPU.
+
+        Parameters
+        ----------
+        video_path : str
+            The path to the video file.
+        frames_folder : str
+            The folder the frames are written to.
+        use_hwaccel : bool
+            Whether to decode with the configured hardware decoder.
+        start_time : float or None
+            The time of the keyframe the segment starts at, or None to start at the beginning.
+        start_number : int
+            The frame number of the first frame of the segment.
+        num_frames : int or None
+            The number of frames in the segment, or None to extract until the end of the video.
+        threads : int, optional
+            The number of decoder and encoder threads, or 0 to use all cores. Default is 0.
+        """
+        input_args = _decode_thread_args(threads) + ['-i', video_path]
+        if start_time is not None:
+            # Round down so the keyframe itself is not dropped by ffmpeg's accurate seeking.
+            input_args = ['-ss', f"{math.floor(start_time * 1000000) / 1000000:.6f}"] + input_args
+
+        output_args = _passthrough_args() + ['-threads', str(threads), '-start_number', str(start_number)]
+        if self.image_format.lower() in ('jpg', 'jpeg'):
+            output_args += ['-qscale:v', str(_jpeg_qscale(self.jpeg_quality))]
+        if num_frames is not None:
+            output_args += ['-frames:v', str(num_frames)]
+        output_args.append(os.path.join(frames_folder, f"frame_%d.{self.image_format}"))
+
+        if use_hwaccel:
+            download_filter = 'hwdownload,format=nv12'
+            if self.hwaccel == 'cuda':
+                # Convert 10-bit and 4:4:4 sources to 8-bit NV12 on the GPU so only the smallest frame
+                # representation is copied to the host for encoding.
+                download_filter = 'scale_cuda=format=nv12,' + download_filter
+            try:
+                _run_ffmpeg(
+                    ['-hwaccel', self.hwaccel, '-hwaccel_output_format', self.hwaccel] + input_args
+                    + ['-vf', download_filter] + output_args
+                )
+                return
+            except subprocess.CalledProcessError:
+                _failed_hwaccels.add(self.hwaccel)
+                logging.warning(f"Hardware decoding of {video_path} failed, falling back to software decoding")
+
+        _run_ffmpeg(input_args + output_args)
+
+    def _extract_to_folder(self, mov_file, frames_folder, total_frames):
+        """
+        Decodes and encodes frames in Python and writes them to the frames folder.
+
+        Used if ffmpeg is not installed.
+
+        Parameters
+        ----------
+        mov_file : str
+            The name of the video file to extract frames from.
+        frames_folder : str
+            The folder the frames are written to, named frame_<n> starting at 0.
+        total_frames : int
+            The expected number of frames, used for the progress bar.
+        """
+        frame_prefix = os.path.join(frames_folder, 'frame_')
+        frame_suffix = f".{self.image_format}"
+
+        def store_frame(frame_number, data):
+            with open(frame_prefix + str(frame_number) + frame_suffix, 'wb') as f:
+                f.write(data)
+
+        self._extract_frame_by_frame(mov_file, store_frame, total_frames)
+
+    def _extract_to_archive(self, mov_file, archive_path, total_frames):
+        """
+        Decodes and encodes frames in Python and writes them into an uncompressed tar archive.
+
+        The archive is written under a temporary name and renamed once complete, so an existing archive
+        always holds all frames. Frames are encoded in parallel but added in frame order, so the archive
+        can be read sequentially.
+
+        Parameters
+        ----------
+        mov_file : str
+            The name of the video file to extract frames from.
+        archive_path : str
+            The path of the archive, whose members are named frame_<n> with n zero-padded to 7 digits.
+        total_frames : int
+            The expected number of frames, used for the progress bar.
+
+        Raises
+        ------
+        ValueError
+            If no frames could be extracted, in which case no archive is written.
+        """
+        partial_path = f"{archive_path}.part"
+        lock = threading.Lock()
+        mtime = time.time()
+        pending = {}
+        next_frame = 0
+
+        with tarfile.open(partial_path, 'w') as tar:
+            def store_frame(frame_number, data):
+                nonlocal next_frame
+                with lock:
+                    # Hold back frames encoded ahead of an earlier one until the gap is filled.
+                    pending[frame_number] = data
+                    while next_frame in pending:
+                        data = pending.pop(next_frame)
+                        info = tarfile.TarInfo(f"frame_{next_frame:07d}.{self.image_format}")
+                        info.size = len(data)
+                        info.mtime = mtime
+                        tar.addfile(info, io.BytesIO(data))
+                        next_frame += 1
+
+            self._extract_frame_by_frame(mov_file, store_frame, total_frames)
+
+        if not next_frame:
+            os.remove(partial_path)
+            raise ValueError(f"No frames could be extracted from {mov_file}")
+        os.replace(partial_path, archive_path)
+
+    def _extract_frame_by_frame(self, mov_file, store_frame, total_frames):
+        """
+        Decodes frames with iter_frames and encodes them in Python.
+
+        Frames are decoded in a reader thread and encoded by a pool of write_threads threads, so storing
+        frames does not stall the decoder. Both JPEG and PNG encoders release the GIL. Frames are decoded
+        into a fixed pool of FRAME_PREFETCH arrays that are reused once a frame is encoded, which bounds
+        memory and avoids allocating a new array for every frame.
+
+        Parameters
+        ----------
+        mov_file : str
+            The name of the video file to extract frames from.
+        store_frame : callable
+            Called with the frame number and the encoded image from the encoding threads.
+        total_frames : int
+            The expected number of frames, used for the progress bar.
+        """
+        encode_params = []
+        if self.image_format.lower() in ('jpg', 'jpeg'):
+            encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]
+
+        read_queue = queue.Queue()
+        buffers = queue.Queue()
+        for _ in range(FRAME_PREFETCH):
+            buffers.put(None)
+        errors = []
+
+        def read_frames():
+            frames = self.iter_frames(mov_file, buffers)
+            try:
+                for item in frames:
+                    if errors:
+                        break
+                    read_queue.put(item)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                frames.close()
+                read_queue.put(None)
+
+        def write_frame(frame_number, frame):
+            try:
+                data = self._encode_frame(frame, encode_params)
+            finally:
+                buffers.put(frame)
+            store_frame(frame_number, data)
+
+        with tqdm(total=total_frames) as pbar, ThreadPoolExecutor(max_workers=self.write_threads) as executor:
+            def frame_written(future):
+                if future.exception() is not None:
+                    errors.append(future.exception())
                 pbar.update(1)
 
-        cap.release()
+            reader = threading.Thread(target=read_frames, daemon=True)
+            reader.start()
 
-        metadata_file = os.path.join(self.output_folder, f"{mov_file}_metadata.json")
-        with open(metadata_file, 'w') as f:
-            json.dump(metadata, f, indent=4)
+            while True:
+                item = read_queue.get()
+                if item is None:
+                    break
+                frame_number, frame = item
+                if errors:
+                    buffers.put(frame)
+                    continue
+                executor.submit(write_frame, frame_number, frame).add_done_callback(frame_written)
 
-        
-        logging.info(f"Extracted frames and metadata from {mov_file}")
+            reader.join()
+
+        if errors:
+            raise errors[0]
+
+    def _encode_frame(self, frame, encode_params):
+        """
+        Encodes a BGR frame in the configured image format.
+
+        JPEGs are encoded with libjpeg-turbo via PyTurboJPEG if it is available, everything else with OpenCV.
+
+        Parameters
+        ----------
+        frame : numpy.ndarray
+            The frame in BGR order.
+        encode_params : list of int
+            The parameters passed to cv2.imencode.
 
+        Returns
+        -------
+        bytes
+            The encoded image.
+        """
+        if self._turbojpeg is not None:
+            # 4:2:0 chroma subsampling, like OpenCV and ffmpeg, instead of PyTurboJPEG's default of 4:2:2.
+            return self._turbojpeg.encode(frame, quality=self.jpeg_quality, jpeg_subsample=TJSAMP_420)
+
+        ret, data = cv2.imencode(f".{self.image_format}", frame, encode_params)
+        if not ret:
+            raise ValueError(f"Could not encode frame as {self.image_format}")
+        return data.tobytes()
+
+
+def _process_one(args):
+    """
+    Processes a single video in a worker process.
+
+    Parameters
+    ----------
+    args : tuple
+        The extractor options returned by VideoFrameExtractor._worker_options and the name of the video file.
+    """
+    options, mov_file = args
+    VideoFrameExtractor(**options).process_video(mov_file)
@@ -7,6 +7,7 @@ setup(
     install_requires=[
         'opencv-python',
         'tqdm',
+        'PyTurboJPEG',
     ],
     author='Thomas J. Lux',
     author_email='lux_t1@ukw.de',
@@ -1,14 +1,359 @@
+import json
+import os
+import queue
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
 import unittest
-from agl_frame_extractor.extractor import VideoFrameExtractor
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from agl_frame_extractor import extractor as extractor_module
+from agl_frame_extractor.extractor import (
+    VideoFrameExtractor, _jpeg_qscale, _keyframe_offsets, _probe_codec, _probe_frame_size, _probe_metadata,
+    _run_ffprobe,
+)
+
+
+def write_test_video(path, num_frames=12, size=(64, 48), fps=10):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(num_frames):
+        writer.write(np.full((size[1], size[0], 3), i * 10, np.uint8))
+    writer.release()
+
+
+def write_vfr_test_video(path):
+    # 90 frames with a pause after every 4th one and a keyframe every 10 frames.
+    subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=64x48:rate=30',
+         '-frames:v', '90', '-vf', "setpts='(N+floor(N/4)*2)/30/TB'", '-fps_mode', 'vfr',
+         '-c:v', 'libx264', '-g', '10', '-bf', '2', '-pix_fmt', 'yuv420p', path],
+        check=True,
+    )
+
 
 class TestVideoFrameExtractor(unittest.TestCase):
-    
+
     def test_initialization(self):
         extractor = VideoFrameExtractor("input", "output")
         self.assertEqual(extractor.input_folder, "input")
         self.assertEqual(extractor.output_folder, "output")
 
-    # Add more tests here
+    def test_process_video(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_folder = os.path.join(tmp, "input")
+            output_folder = os.path.join(tmp, "output")
+            os.makedirs(input_folder)
+            write_test_video(os.path.join(input_folder, "test.MOV"))
+
+            with mock.patch('agl_frame_extractor.extractor.ProcessPoolExecutor') as pool:
+                VideoFrameExtractor(input_folder, output_folder).extract_frames_and_metadata()
+            pool.assert_not_called()
+
+            frames = [f for f in os.listdir(os.path.join(output_folder, "test.MOV_frames")) if f.endswith(".jpg")]
+            self.assertEqual(len(frames), 12)
+            self.assertIn("frame_0.jpg", frames)
+            self.assertIn("frame_11.jpg", frames)
+            with open(os.path.join(output_folder, "test.MOV_metadata.json"), encoding='utf-8') as f:
+                metadata = json.load(f)
+            self.assertEqual(metadata['total_frames'], 12)
+            self.assertEqual(metadata['fps'], 10)
+            self.assertEqual(metadata['duration'], 1200)
+
+            extractor = VideoFrameExtractor(input_folder, output_folder)
+            self.assertTrue(extractor.frames_already_extracted("test.MOV"))
+            self.assertFalse(VideoFrameExtractor(input_folder, output_folder, image_format='png')
+                             .frames_already_extracted("test.MOV"))
+
+            os.remove(os.path.join(output_folder, "test.MOV_frames", ".done"))
+            self.assertTrue(extractor.frames_already_extracted("test.MOV"))
+            with open(os.path.join(output_folder, "test.MOV_metadata.json"), 'w', encoding='utf-8') as f:
+                f.write('{"video_file": "test.MOV", "total_fr')
+            self.assertFalse(extractor.frames_already_extracted("test.MOV"))
+
+    def test_unreadable_video(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_folder = os.path.join(tmp, "input")
+            output_folder = os.path.join(tmp, "output")
+            os.makedirs(input_folder)
+            with open(os.path.join(input_folder, "broken.MOV"), 'wb') as f:
+                f.write(b"not a video")
+
+            VideoFrameExtractor(input_folder, output_folder).extract_frames_and_metadata()
+
+            extractor = VideoFrameExtractor(input_folder, output_folder)
+            self.assertFalse(extractor.frames_already_extracted("broken.MOV"))
+            self.assertFalse(os.path.exists(os.path.join(output_folder, "broken.MOV_metadata.json")))
+            with self.assertRaises(ValueError):
+                extractor.process_video("broken.MOV")
+
+    def test_archive_frames(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_test_video(os.path.join(tmp, "test.MOV"))
+
+            extractor = VideoFrameExtractor(tmp, tmp, archive_frames=True)
+            encode_frame = extractor._encode_frame
+
+            def encode_first_frame_last(frame, encode_params):
+                if not frame.any():
+                    time.sleep(0.2)
+                return encode_frame(frame, encode_params)
+
+            with mock.patch.object(extractor, '_encode_frame', side_effect=encode_first_frame_last):
+                extractor.process_video("test.MOV")
+
+            with tarfile.open(os.path.join(tmp, "test.MOV_frames.tar")) as tar:
+                names = tar.getnames()
+            self.assertEqual(names, [f"frame_{i:07d}.jpg" for i in range(12)])
+            self.assertFalse(os.path.exists(os.path.join(tmp, "test.MOV_frames")))
+            self.assertTrue(extractor.frames_already_extracted("test.MOV"))
+
+    def test_iter_frames(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_test_video(os.path.join(tmp, "test.MOV"))
+
+            frames = list(VideoFrameExtractor(tmp, tmp).iter_frames("test.MOV"))
+            self.assertEqual([frame_number for frame_number, _ in frames], list(range(12)))
+            self.assertEqual(frames[0][1].shape, (48, 64, 3))
+
+            buffers = queue.Queue()
+            buffers.put(None)
+            frame_ids = set()
+            for _, frame in VideoFrameExtractor(tmp, tmp).iter_frames("test.MOV", buffers):
+                frame_ids.add(id(frame))
+                buffers.put(frame)
+            self.assertEqual(len(frame_ids), 1)
+
+    def test_iter_frames_hwaccel_args(self):
+        extractor = VideoFrameExtractor("input", "output", hwaccel='vaapi')
+        process = mock.Mock(returncode=0)
+        process.stdout.readinto.return_value = 0
+        with mock.patch.object(extractor, '_use_hwaccel', return_value=True), \
+                mock.patch('agl_frame_extractor.extractor._passthrough_args', return_value=[]), \
+                mock.patch('subprocess.Popen', return_value=process) as popen:
+            self.assertEqual(list(extractor._iter_frames_ffmpeg("test.MOV", 64, 48, None)), [])
+        args = popen.call_args.args[0]
+        self.assertEqual(args[args.index('-hwaccel') + 1], 'vaapi')
+        self.assertNotIn('-hwaccel_output_format', args)
+        self.assertLess(args.index('-hwaccel'), args.index('-i'))
+
+    @unittest.skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), "ffmpeg is not installed")
+    def test_iter_frames_variable_frame_rate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_vfr_test_video(os.path.join(tmp, "test.mp4"))
+
+            extractor = VideoFrameExtractor(tmp, tmp, hwaccel=None)
+            frame_numbers = [frame_number for frame_number, _ in extractor.iter_frames("test.mp4")]
+            self.assertEqual(frame_numbers, list(range(90)))
+
+    def test_video_metadata_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            extractor = VideoFrameExtractor(tmp, tmp)
+            probed = {'total_frames': 12, 'fps': 10, 'duration': 1200}
+            for cached, reprobe in (({'total_frames': 12, 'fps': 10, 'duration': 1200}, False),
+                                    ({'total_frames': 12, 'fps': 10, 'duration': 0}, True),
+                                    ({'total_frames': 12, 'fps': 10}, True),
+                                    ({'total_frames': 0, 'fps': 10, 'duration': 1200}, True)):
+                with open(os.path.join(tmp, "test.MOV_metadata.json"), 'w', encoding='utf-8') as f:
+                    json.dump({'video_file': "test.MOV", **cached}, f)
+                with mock.patch('agl_frame_extractor.extractor._probe_metadata', return_value=probed) as probe:
+                    metadata = extractor._video_metadata("test.MOV")
+                self.assertEqual(probe.called, reprobe)
+                self.assertEqual(metadata, {'video_file': "test.MOV", **(probed if reprobe else cached)})
+
+    def test_run_ffprobe(self):
+        completed = subprocess.CompletedProcess([], 0, stdout='{"streams": [{"codec_name": "h264"}]}')
+        with mock.patch('subprocess.run', return_value=completed) as run:
+            self.assertEqual(_run_ffprobe("test.MOV", 'stream=codec_name'), {'streams': [{'codec_name': 'h264'}]})
+        args = run.call_args.args[0]
+        self.assertEqual(args[args.index('-show_entries') + 1], 'stream=codec_name')
+        self.assertEqual(args[-1], "test.MOV")
+
+        with mock.patch('subprocess.run', side_effect=OSError):
+            self.assertIsNone(_run_ffprobe("test.MOV", 'stream=codec_name'))
+        with mock.patch('subprocess.run', side_effect=subprocess.CalledProcessError(1, 'ffprobe')):
+            self.assertIsNone(_run_ffprobe("test.MOV", 'stream=codec_name'))
+
+    def test_probe_parsers(self):
+        def probe(output):
+            return mock.patch('agl_frame_extractor.extractor._run_ffprobe', return_value=output)
+
+        with probe({'streams': [{'codec_name': 'hevc'}]}):
+            self.assertEqual(_probe_codec("test.MOV"), 'hevc')
+        with probe(None):
+            self.assertIsNone(_probe_codec("test.MOV"))
+            self.assertIsNone(_probe_frame_size("test.MOV"))
+            self.assertIsNone(_probe_metadata("test.MOV"))
+            self.assertEqual(_keyframe_offsets("test.MOV"), [])
+
+        with probe({'streams': [{'width': 1920, 'height': 1080}]}):
+            self.assertEqual(_probe_frame_size("test.MOV"), (1920, 1080))
+        with probe({'streams': [{'width': 1920, 'height': 1080, 'tags': {'rotate': '90'}}]}):
+            self.assertEqual(_probe_frame_size("test.MOV"), (1080, 1920))
+        with probe({'streams': [{'width': 1920, 'height': 1080, 'side_data_list': [{'rotation': -90}]}]}):
+            self.assertEqual(_probe_frame_size("test.MOV"), (1080, 1920))
+        with probe({'streams': [{'width': 1920, 'height': 1080, 'side_data_list': [{'rotation': 180}]}]}):
+            self.assertEqual(_probe_frame_size("test.MOV"), (1920, 1080))
+
+        with probe({'streams': [{'nb_frames': '300', 'avg_frame_rate': '30000/1001', 'duration': '10.01'}]}):
+            self.assertEqual(_probe_metadata("test.MOV"), {'total_frames': 300, 'fps': 29, 'duration': 10010})
+        with probe({'streams': [{'avg_frame_rate': '25/1'}], 'format': {'duration': '4.0'}}):
+            self.assertEqual(_probe_metadata("test.MOV"), {'total_frames': 100, 'fps': 25, 'duration': 4000})
+
+        packets = [
+            {'pts': '2048', 'flags': 'K__'},
+            {'pts': '1536', 'flags': 'K__'},
+            {'pts': '1024', 'flags': '___'},
+            {'pts': '512', 'flags': 'K_D'},
+            {'pts': '2560', 'flags': '___'},
+            {'flags': '___'},
+        ]
+        with probe({'packets': packets, 'streams': [{'time_base': '1/512'}], 'format': {'start_time': '1.0'}}):
+            self.assertEqual(_keyframe_offsets("test.MOV"), [(2.0, 1), (3.0, 2)])
+
+    def test_segments(self):
+        extractor = VideoFrameExtractor("input", "output", segment_workers=2)
+        keyframes = [(0.0, 0), (1.0, 30), (2.0, 60), (3.0, 90)]
+        with mock.patch('agl_frame_extractor.extractor._keyframe_offsets', return_value=keyframes):
+            segments = extractor._segments("test.MOV")
+        self.assertEqual(segments, [(None, 0, 60), (2.0, 60, None)])
+
+        keyframes = [(0.1, 3), (1.0, 30), (2.0, 60), (3.0, 90)]
+        with mock.patch('agl_frame_extractor.extractor._keyframe_offsets', return_value=keyframes):
+            segments = extractor._segments("test.MOV")
+        self.assertEqual(segments, [(None, 0, 60), (2.0, 60, None)])
+
+        with mock.patch('agl_frame_extractor.extractor._keyframe_offsets', return_value=[]):
+            segments = extractor._segments("test.MOV")
+        self.assertEqual(segments, [(None, 0, None)])
+
+        extractor = VideoFrameExtractor("input", "output", segment_workers=1)
+        with mock.patch('agl_frame_extractor.extractor._keyframe_offsets') as keyframe_offsets:
+            segments = extractor._segments("test.MOV")
+        self.assertEqual(segments, [(None, 0, None)])
+        keyframe_offsets.assert_not_called()
+
+        extractor = VideoFrameExtractor("input", "output")
+        with mock.patch('os.cpu_count', return_value=None), \
+                mock.patch('agl_frame_extractor.extractor._keyframe_offsets') as keyframe_offsets:
+            segments = extractor._segments("test.MOV")
+        self.assertEqual(segments, [(None, 0, None)])
+        keyframe_offsets.assert_not_called()
+
+    def test_segment_args(self):
+        extractor = VideoFrameExtractor("input", "output", image_format='png')
+        with mock.patch('agl_frame_extractor.extractor._passthrough_args', return_value=['-fps_mode', 'passthrough']), \
+                mock.patch('agl_frame_extractor.extractor._run_ffmpeg') as run_ffmpeg:
+            extractor._extract_segment("test.MOV", "frames", False, None, 0, 60)
+            extractor._extract_segment("test.MOV", "frames", False, 2.0, 60, None)
+        first, last = (call.args[0] for call in run_ffmpeg.call_args_list)
+
+        self.assertNotIn('-ss', first)
+        self.assertEqual(first[first.index('-start_number') + 1], '0')
+        self.assertEqual(first[first.index('-frames:v') + 1], '60')
+        self.assertEqual(first[-1], os.path.join("frames", "frame_%d.png"))
+
+        self.assertEqual(first[first.index('-threads') + 1], '0')
+
+        self.assertLess(last.index('-ss'), last.index('-i'))
+        self.assertEqual(last[last.index('-ss') + 1], '2.000000')
+        self.assertEqual(last[last.index('-start_number') + 1], '60')
+        self.assertNotIn('-frames:v', last)
+        self.assertIn('passthrough', last)
+
+    def test_jpeg_qscale(self):
+        self.assertEqual(_jpeg_qscale(85), 5)
+        self.assertEqual(_jpeg_qscale(95), 2)
+        self.assertEqual(_jpeg_qscale(100), 2)
+        self.assertEqual(_jpeg_qscale(50), 16)
+        self.assertEqual(_jpeg_qscale(0), 31)
+
+        extractor = VideoFrameExtractor("input", "output", jpeg_quality=50)
+        with mock.patch('agl_frame_extractor.extractor._passthrough_args', return_value=[]), \
+                mock.patch('agl_frame_extractor.extractor._run_ffmpeg') as run_ffmpeg:
+            extractor._extract_segment("test.MOV", "frames", False, None, 0, None)
+        args = run_ffmpeg.call_args.args[0]
+        self.assertEqual(args[args.index('-qscale:v') + 1], '16')
+
+    @unittest.skipIf(extractor_module.TurboJPEG is None, "PyTurboJPEG is not installed")
+    def test_encode_frame_turbojpeg(self):
+        extractor = VideoFrameExtractor("input", "output", jpeg_quality=90)
+        extractor._turbojpeg = mock.Mock()
+        frame = np.zeros((48, 64, 3), np.uint8)
+        extractor._encode_frame(frame, [])
+        extractor._turbojpeg.encode.assert_called_once_with(
+            frame, quality=90, jpeg_subsample=extractor_module.TJSAMP_420)
+
+    def test_segment_threads(self):
+        extractor = VideoFrameExtractor("input", "output", hwaccel=None)
+        segments = [(None, 0, 30), (1.0, 30, 30), (2.0, 60, None)]
+        with mock.patch('os.cpu_count', return_value=8), \
+                mock.patch.object(extractor, '_segments', return_value=segments), \
+                mock.patch('agl_frame_extractor.extractor._passthrough_args', return_value=[]), \
+                mock.patch('agl_frame_extractor.extractor._run_ffmpeg') as run_ffmpeg:
+            extractor._extract_with_ffmpeg("test.MOV", "frames")
+        for call in run_ffmpeg.call_args_list:
+            args = call.args[0]
+            self.assertEqual([args[i + 1] for i, arg in enumerate(args) if arg == '-threads'], ['2', '2'])
+
+        with mock.patch.object(extractor, '_segments', return_value=[(None, 0, None)]), \
+                mock.patch('agl_frame_extractor.extractor._passthrough_args', return_value=[]), \
+                mock.patch('agl_frame_extractor.extractor._run_ffmpeg') as run_ffmpeg:
+            extractor._extract_with_ffmpeg("test.MOV", "frames")
+        args = run_ffmpeg.call_args.args[0]
+        self.assertEqual([args[i + 1] for i, arg in enumerate(args) if arg == '-threads'], ['0', '0'])
+
+    @unittest.skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), "ffmpeg is not installed")
+    def test_segments_variable_frame_rate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_vfr_test_video(os.path.join(tmp, "test.mp4"))
+
+            frames = {}
+            for segment_workers in (1, 4):
+                output_folder = os.path.join(tmp, str(segment_workers))
+                extractor = VideoFrameExtractor(tmp, output_folder, image_format='png', hwaccel=None,
+                                                segment_workers=segment_workers)
+                os.makedirs(output_folder)
+                extractor.process_video("test.mp4")
+                frames_folder = os.path.join(output_folder, "test.mp4_frames")
+                frames[segment_workers] = {}
+                for name in (f for f in os.listdir(frames_folder) if f.endswith(".png")):
+                    with open(os.path.join(frames_folder, name), 'rb') as f:
+                        frames[segment_workers][name] = f.read()
+
+            self.assertEqual(sorted(frames[1]), sorted(f"frame_{i}.png" for i in range(90)))
+            self.assertEqual(frames[4], frames[1])
+
+    @mock.patch('agl_frame_extractor.extractor._failed_hwaccels', set())
+    def test_hwaccel_fallback(self):
+        extractor = VideoFrameExtractor("input", "output")
+        with mock.patch('agl_frame_extractor.extractor._hwaccel_available', return_value=False), \
+                mock.patch('agl_frame_extractor.extractor._probe_codec') as probe_codec:
+            self.assertFalse(extractor._use_hwaccel("test.MOV"))
+        probe_codec.assert_not_called()
+
+        with mock.patch('agl_frame_extractor.extractor._hwaccel_available', return_value=True), \
+                mock.patch('agl_frame_extractor.extractor._probe_codec', return_value='h264'), \
+                mock.patch('agl_frame_extractor.extractor._passthrough_args', return_value=[]), \
+                mock.patch('agl_frame_extractor.extractor._run_ffmpeg',
+                           side_effect=[subprocess.CalledProcessError(1, 'ffmpeg'), None]) as run_ffmpeg:
+            self.assertTrue(extractor._use_hwaccel("test.MOV"))
+            extractor._extract_segment("test.MOV", "frames", True, None, 0, None)
+            self.assertEqual(run_ffmpeg.call_count, 2)
+            self.assertIn('-hwaccel', run_ffmpeg.call_args_list[0].args[0])
+            hwaccel_args = run_ffmpeg.call_args_list[0].args[0]
+            self.assertEqual(hwaccel_args[hwaccel_args.index('-hwaccel_output_format') + 1], 'cuda')
+            self.assertEqual(hwaccel_args[hwaccel_args.index('-vf') + 1],
+                             'scale_cuda=format=nv12,hwdownload,format=nv12')
+            self.assertLess(hwaccel_args.index('-hwaccel'), hwaccel_args.index('-i'))
+            self.assertNotIn('-hwaccel', run_ffmpeg.call_args_list[1].args[0])
+            self.assertFalse(extractor._use_hwaccel("test.MOV"))
+            self.assertFalse(VideoFrameExtractor("input", "output")._use_hwaccel("test.MOV"))
+
 
 if __name__ == '__main__':
     unittest.main()